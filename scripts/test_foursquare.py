@@ -1,50 +1,61 @@
 import os
-import requests
+import asyncio
+import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def test_foursquare():
-    token = os.getenv("FOURSQUARE_API_KEY")
-    if not token:
-        print("FOURSQUARE_API_KEY not found in .env")
-        return
+SEARCH_URL = "https://places-api.foursquare.com/places/search"
 
-    url = "https://places-api.foursquare.com/places/search"
+# Cities probed concurrently in one smoke test.
+NEAR = ["New York, NY", "San Francisco, CA"]
+
+async def probe(client, near: str, token: str):
     headers = {
         "X-Places-Api-Version": "2025-06-17",
         "accept": "application/json",
         "authorization": f"Bearer {token}",
     }
-
     params = {
         "query": "restaurant",
-        "near": "New York, NY",
-        "limit": 1
+        "near": near,
+        "limit": 1,
     }
+    r = await client.get(SEARCH_URL, headers=headers, params=params)
+    return near, r
 
-    r = requests.get(url, headers=headers, params=params, timeout=20)
-    print("HTTP Status Code:", r.status_code)
-
-    try:
-        data = r.json()
-    except Exception:
-        print("Non-JSON response:", r.text[:300])
+async def test_foursquare():
+    token = os.getenv("FOURSQUARE_API_KEY")
+    if not token:
+        print("FOURSQUARE_API_KEY not found in .env")
         return
 
-    if r.status_code != 200:
-        print("Foursquare API Error:", data)
-        return
+    async with httpx.AsyncClient(http2=True, timeout=20) as client:
+        results = await asyncio.gather(*[probe(client, n, token) for n in NEAR])
 
-    results = data.get("results", [])
-    if not results:
-        print("⚠️ No results returned:", data)
-        return
+    for near, r in results:
+        print(f"\n--- near {near} ---")
+        print("HTTP Status Code:", r.status_code)
+
+        try:
+            data = r.json()
+        except Exception:
+            print("Non-JSON response:", r.text[:300])
+            continue
+
+        if r.status_code != 200:
+            print("Foursquare API Error:", data)
+            continue
+
+        places = data.get("results", [])
+        if not places:
+            print("⚠️ No results returned:", data)
+            continue
 
-    first = results[0]
-    print("Test call successful!")
-    print("Name:", first.get("name"))
-    print("Address:", first.get("location", {}).get("formatted_address"))
+        first = places[0]
+        print("Test call successful!")
+        print("Name:", first.get("name"))
+        print("Address:", first.get("location", {}).get("formatted_address"))
 
 if __name__ == "__main__":
-    test_foursquare()
+    asyncio.run(test_foursquare())
@@ -1,42 +1,53 @@
 import os
-import requests
+import asyncio
+import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def test_google_places():
+TEXTSEARCH_URL = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+
+# One smoke-test query per target city, all fired concurrently.
+QUERIES = [
+    "restaurants in New York",
+    "restaurants in San Francisco",
+    "restaurants in Los Angeles",
+    "restaurants in Chicago",
+]
+
+async def probe(client, query: str, api_key: str):
+    r = await client.get(TEXTSEARCH_URL, params={"query": query, "key": api_key})
+    return query, r.status_code, r.json()
+
+async def test_google_places():
     api_key = os.getenv("GOOGLE_API_KEY")
 
     if not api_key:
         print("GOOGLE_API_KEY not found. Check your .env file.")
         return
 
-    url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
-    params = {
-        "query": "restaurants in New York",
-        "key": api_key
-    }
-
-    response = requests.get(url, params=params, timeout=20)
+    # HTTP/2 multiplexes all probes over a single TLS connection.
+    async with httpx.AsyncClient(http2=True, timeout=20) as client:
+        results = await asyncio.gather(*[probe(client, q, api_key) for q in QUERIES])
 
-    print("HTTP Status Code:", response.status_code)
+    for query, status_code, data in results:
+        print(f"\n--- {query} ---")
+        print("HTTP Status Code:", status_code)
 
-    data = response.json()
+        if "error_message" in data:
+            print("Google API Error:", data["error_message"])
+            continue
 
-    if "error_message" in data:
-        print("Google API Error:", data["error_message"])
-        return
-
-    results = data.get("results", [])
-    if not results:
-        print("No results returned:", data)
-        return
+        places = data.get("results", [])
+        if not places:
+            print("No results returned:", data)
+            continue
 
-    first = results[0]
-    print("Test call successful!")
-    print("Name:", first.get("name"))
-    print("Address:", first.get("formatted_address"))
-    print("Rating:", first.get("rating"))
+        first = places[0]
+        print("Test call successful!")
+        print("Name:", first.get("name"))
+        print("Address:", first.get("formatted_address"))
+        print("Rating:", first.get("rating"))
 
 if __name__ == "__main__":
-    test_google_places()
+    asyncio.run(test_google_places())
@@ -1,18 +1,45 @@
 import os
-import json
-import sqlite3
+import hashlib
+import duckdb
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # headless: never spin up an interactive backend
 import matplotlib.pyplot as plt
 import seaborn as sns
 from src.config import BASE_DIR, DB_PATH, FIG_DIR
 
 sns.set_theme(style="whitegrid")
 
-def savefig(name: str):
+def df_signature(df: pd.DataFrame) -> str:
+    """Stable content hash of the aggregate feeding a figure.
+
+    DuckDB's parallel GROUP BY returns rows in unstable order, so sort
+    before hashing — otherwise identical data hashes differently per run
+    and the figure cache never hits.
+    """
+    ordered = df.sort_values(list(df.columns)).reset_index(drop=True)
+    hashed = pd.util.hash_pandas_object(ordered, index=False).values.tobytes()
+    return hashlib.blake2b(hashed, digest_size=16).hexdigest()
+
+def figure_cached(name: str, df: pd.DataFrame) -> bool:
+    """True if the saved PNG was rendered from an identical DataFrame."""
+    path = os.path.join(FIG_DIR, name)
+    sig_path = path + ".sig"
+    if os.path.exists(path) and os.path.exists(sig_path):
+        with open(sig_path) as f:
+            if f.read() == df_signature(df):
+                print(f"[cache] {path} unchanged, skipping render")
+                return True
+    return False
+
+def savefig(name: str, df: pd.DataFrame):
     os.makedirs(FIG_DIR, exist_ok=True)
     path = os.path.join(FIG_DIR, name)
     plt.tight_layout()
     plt.savefig(path, dpi=200)
+    plt.close(plt.gcf())  # release figure memory between plots
+    with open(path + ".sig", "w") as f:
+        f.write(df_signature(df))
     print(f"[saved] {path}")
 
 def main():
@@ -21,110 +48,100 @@ def main():
     if not os.path.exists(DB_PATH):
         raise FileNotFoundError(f"Cannot find DB at: {DB_PATH}")
 
-    conn = sqlite3.connect(DB_PATH)
+    # DuckDB attaches the SQLite file and runs the aggregations with its
+    # vectorized, multi-threaded engine; results come back as tiny frames.
+    con = duckdb.connect()
+    con.execute("INSTALL sqlite; LOAD sqlite;")
+    con.execute(f"ATTACH '{DB_PATH}' AS s (TYPE sqlite)")
 
     # ---------- load data ----------
-    df = pd.read_sql("""
-        SELECT
-            city,
-            name,
-            rating,
-            user_ratings_total,
-            price_level,
-            business_status,
-            types
-        FROM restaurants
-    """, conn)
-
-    conn.close()
-
-    df_rating = df[df["rating"].notna()].copy()
 
     # 1) Average rating by city
-    avg_rating_city = (
-        df_rating.groupby("city")["rating"]
-        .mean()
-        .reset_index()
-        .sort_values("rating", ascending=False)
-    )
-
-    plt.figure(figsize=(8, 5))
-    sns.barplot(data=avg_rating_city, x="city", y="rating")
-    plt.title("Average Restaurant Rating by City")
-    plt.ylabel("Average Rating")
-    plt.xlabel("City")
-    plt.ylim(3.5, 5.0) 
-    savefig("01_avg_rating_by_city.png")
-    plt.show()
+    avg_rating_city = con.execute("""
+        SELECT city, AVG(rating) AS rating
+        FROM s.restaurants
+        WHERE rating IS NOT NULL
+        GROUP BY city
+        ORDER BY rating DESC
+    """).df()
+
+    if not figure_cached("01_avg_rating_by_city.png", avg_rating_city):
+        plt.figure(figsize=(8, 5))
+        sns.barplot(data=avg_rating_city, x="city", y="rating")
+        plt.title("Average Restaurant Rating by City")
+        plt.ylabel("Average Rating")
+        plt.xlabel("City")
+        plt.ylim(3.5, 5.0) 
+        savefig("01_avg_rating_by_city.png", avg_rating_city)
 
     print("\n=== Average Rating by City ===")
     print(avg_rating_city.to_string(index=False))
 
     # 2) Price level distribution per city
-    price_df = df[df["price_level"].notna()].copy()
-
-    plt.figure(figsize=(10, 6))
-    sns.countplot(data=price_df, x="price_level", hue="city")
-    plt.title("Price Level Distribution by City")
-    plt.xlabel("Price Level (0=cheapest, 4=most expensive)")
-    plt.ylabel("Number of Restaurants")
-    savefig("02_price_level_distribution_by_city.png")
-    plt.show()
+    price_counts = con.execute("""
+        SELECT city, price_level, COUNT(*) AS n
+        FROM s.restaurants
+        WHERE price_level IS NOT NULL
+        GROUP BY city, price_level
+    """).df()
+
+    if not figure_cached("02_price_level_distribution_by_city.png", price_counts):
+        plt.figure(figsize=(10, 6))
+        sns.barplot(data=price_counts, x="price_level", y="n", hue="city")
+        plt.title("Price Level Distribution by City")
+        plt.xlabel("Price Level (0=cheapest, 4=most expensive)")
+        plt.ylabel("Number of Restaurants")
+        savefig("02_price_level_distribution_by_city.png", price_counts)
 
     print("\n=== Price Level Distribution by City ===")
 
     # 3) Top restaurant types/cuisines (overall)
-    types_df = df[["city", "types"]].dropna().copy()
-
-    def safe_json_load(s):
-        try:
-            return json.loads(s)
-        except Exception:
-            return []
-
-    types_df["types_list"] = types_df["types"].apply(safe_json_load)
-    types_exploded = types_df.explode("types_list").rename(columns={"types_list": "type"})
-    types_exploded = types_exploded[types_exploded["type"].notna()]
-
-    exclude = {"restaurant", "food", "point_of_interest", "establishment", "store"}
-    types_clean = types_exploded[~types_exploded["type"].isin(exclude)].copy()
+    # The JSON arrays are unpacked inside DuckDB, so we never explode one
+    # row per (restaurant x type) in pandas.
+    type_counts = con.execute("""
+        SELECT city, type, COUNT(*) AS count
+        FROM (
+            SELECT city, unnest(from_json(types, '["varchar"]')) AS type
+            FROM s.restaurants
+            WHERE city IS NOT NULL AND types IS NOT NULL AND json_valid(types)
+        )
+        WHERE type NOT IN ('restaurant', 'food', 'point_of_interest', 'establishment', 'store')
+        GROUP BY city, type
+    """).df()
+
+    con.close()
 
     top_types = (
-        types_clean.groupby("type")
-        .size()
-        .sort_values(ascending=False)
-        .head(10)
-        .reset_index(name="count")
+        type_counts.groupby("type", as_index=False)["count"]
+        .sum()
+        .nlargest(10, "count")
     )
 
-    plt.figure(figsize=(10, 6))
-    sns.barplot(data=top_types, y="type", x="count")
-    plt.title("Top 10 Restaurant Types Across All Cities")
-    plt.xlabel("Number of Restaurants")
-    plt.ylabel("Restaurant Type")
-    savefig("03_top10_types_overall.png")
-    plt.show()
+    if not figure_cached("03_top10_types_overall.png", top_types):
+        plt.figure(figsize=(10, 6))
+        sns.barplot(data=top_types, y="type", x="count")
+        plt.title("Top 10 Restaurant Types Across All Cities")
+        plt.xlabel("Number of Restaurants")
+        plt.ylabel("Restaurant Type")
+        savefig("03_top10_types_overall.png", top_types)
 
     print("\n=== Top 10 Types Overall ===")
     print(top_types.to_string(index=False))
 
     # 4) Top 5 types per city (comparison)
     top_types_city = (
-        types_clean.groupby(["city", "type"])
-        .size()
-        .reset_index(name="count")
-        .sort_values(["city", "count"], ascending=[True, False])
+        type_counts.sort_values(["city", "count"], ascending=[True, False])
         .groupby("city")
         .head(5)
     )
 
-    plt.figure(figsize=(12, 6))
-    sns.barplot(data=top_types_city, x="count", y="type", hue="city")
-    plt.title("Top 5 Restaurant Types by City")
-    plt.xlabel("Number of Restaurants")
-    plt.ylabel("Restaurant Type")
-    savefig("04_top5_types_by_city.png")
-    plt.show()
+    if not figure_cached("04_top5_types_by_city.png", top_types_city):
+        plt.figure(figsize=(12, 6))
+        sns.barplot(data=top_types_city, x="count", y="type", hue="city")
+        plt.title("Top 5 Restaurant Types by City")
+        plt.xlabel("Number of Restaurants")
+        plt.ylabel("Restaurant Type")
+        savefig("04_top5_types_by_city.png", top_types_city)
 
     print("\n=== Top 5 Types by City ===")
     for city in sorted(top_types_city["city"].unique()):
@@ -1,10 +1,12 @@
 import os
 import time
-import json
+import orjson
+import simdjson
 import sqlite3
-import requests
-from datetime import datetime
-from typing import Optional, Tuple
+import asyncio
+import httpx
+from typing import Optional
+from urllib.parse import quote
 from dotenv import load_dotenv
 from src.config import DB_PATH
 
@@ -13,51 +15,184 @@ load_dotenv()
 DETAILS_URL = "https://maps.googleapis.com/maps/api/place/details/json"
 
 # ---- runtime knobs ----
-SLEEP_SEC = 0.15         
-BATCH_COMMIT = 200        
+CONCURRENCY = 32          # in-flight Details requests
+MAX_QPS = 6.0             # rate ceiling (AIMD starts here)
+MIN_QPS = 0.5             # floor the limiter never drops below
+QPS_STEP = 0.25           # additive increase per success streak
+QPS_STREAK = 50           # consecutive successes before increasing
+BATCH_COMMIT = 200
 MAX_RETRIES = 6
 TIMEOUT = 20
 
 FIELDS = "address_component,formatted_address"
 
+# SIMD parser shared by all fetches: a Details response is mostly fields we
+# never read, so lazy parsing materializes only the small `result` subtree.
+# Safe to share because parse + extraction happen with no await in between.
+_PARSER = simdjson.Parser()
+
+def details_url_for(api_key: str):
+    """Prebuild the Details URL once; per call only the place_id gets quoted.
+
+    Skips param-dict encoding on every one of thousands of requests. The
+    api_key comes in lazily so os.getenv isn't consulted at import time.
+    """
+    base = f"{DETAILS_URL}?fields={quote(FIELDS)}&key={quote(api_key)}"
+
+    def build(place_id: str) -> str:
+        return f"{base}&place_id={quote(place_id, safe='')}"
+
+    return build
+
 def extract_postal_code(address_components) -> Optional[str]:
-    if not address_components:
-        return None
-    for comp in address_components:
-        types = comp.get("types", [])
-        if "postal_code" in types:
-            return comp.get("long_name")
-    return None
-
-def fetch_details(api_key: str, place_id: str) -> Tuple[Optional[str], Optional[str], str]:
+    return next(
+        (c.get("long_name") for c in (address_components or ())
+         if "postal_code" in (c.get("types") or ())),
+        None,
+    )
+
+class AdaptiveLimiter:
+    """AIMD request pacing shared by every task.
+
+    OVER_QUERY_LIMIT halves the rate (multiplicative decrease); a streak
+    of successes nudges it back up (additive increase), so throughput
+    hovers just under whatever quota Google is actually enforcing
+    instead of burst-retrying into the same 429.
+    """
+
+    def __init__(self, rate: float, min_rate: float = MIN_QPS,
+                 step: float = QPS_STEP, streak: int = QPS_STREAK):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.step = step
+        self.streak = streak
+        self._successes = 0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + 1.0 / self.rate
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def on_success(self):
+        self._successes += 1
+        if self._successes >= self.streak and self.rate < self.max_rate:
+            self._successes = 0
+            self.rate = min(self.max_rate, self.rate + self.step)
+            print(f"[rate] increase to {self.rate:.2f} qps")
+
+    def on_throttle(self):
+        self._successes = 0
+        old = self.rate
+        self.rate = max(self.min_rate, self.rate / 2)
+        if self.rate < old:
+            print(f"[rate] decrease to {self.rate:.2f} qps")
+
+class Throttle:
+    """Shared OVER_QUERY_LIMIT backoff: one throttled request pauses everyone."""
+
+    def __init__(self):
+        self._resume = asyncio.Event()
+        self._resume.set()
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        await self._resume.wait()
+
+    async def pause_all(self, seconds: float):
+        if self._lock.locked():
+            # someone else is already pausing; just wait it out
+            await self._resume.wait()
+            return
+        async with self._lock:
+            self._resume.clear()
+            await asyncio.sleep(seconds)
+            self._resume.set()
+
+async def fetch_details(session, url: str):
     """
     Returns: (postal_code, formatted_address, status)
     status from Google API: OK, OVER_QUERY_LIMIT, REQUEST_DENIED, INVALID_REQUEST, ZERO_RESULTS, etc.
     """
-    params = {
-        "place_id": place_id,
-        "fields": FIELDS,
-        "key": api_key
-    }
-    r = requests.get(DETAILS_URL, params=params, timeout=TIMEOUT)
+    r = await session.get(url)
     r.raise_for_status()
-    data = r.json()
-    status = data.get("status", "UNKNOWN")
+
+    doc = _PARSER.parse(r.content)
+    try:
+        status = doc["status"]
+    except KeyError:
+        status = "UNKNOWN"
 
     if status != "OK":
         return None, None, status
 
-    result = data.get("result", {})
+    try:
+        result = doc["result"].as_dict()
+    except KeyError:
+        result = {}
+
     formatted_address = result.get("formatted_address")
     postal_code = extract_postal_code(result.get("address_components"))
     return postal_code, formatted_address, status
 
+async def fetch_one(session, limiter, sem, throttle, url_for, city, place_id):
+    """Fetch one place's details with retry/backoff. Never touches the DB."""
+    retry = 0
+    backoff = 1.0
+    url = url_for(place_id)
+    while True:
+        await throttle.wait()
+        try:
+            async with sem:
+                async with limiter:
+                    postal_code, formatted_address, status = await fetch_details(session, url)
+
+            if status == "OVER_QUERY_LIMIT":
+                limiter.on_throttle()
+                retry += 1
+                if retry > MAX_RETRIES:
+                    return city, place_id, None, None, status
+                wait = min(60, backoff)
+                print(f"[rate] OVER_QUERY_LIMIT; throttling all requests {wait:.1f}s (place_id={place_id})")
+                backoff *= 2
+                await throttle.pause_all(wait)
+                continue
+
+            limiter.on_success()
+            return city, place_id, postal_code, formatted_address, status
+
+        except httpx.HTTPError as e:
+            retry += 1
+            if retry > MAX_RETRIES:
+                print(f"[net] give up place_id={place_id} after {MAX_RETRIES} retries: {e}")
+                return city, place_id, None, None, "NETWORK_ERROR"
+            wait = min(30, 2 ** retry)
+            print(f"[net] error {e}; retry in {wait}s (place_id={place_id})")
+            await asyncio.sleep(wait)
+
 def ensure_indexes(conn: sqlite3.Connection):
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_restaurants_city_placeid ON restaurants(city, place_id);")
+    # Partial covering index matching the pending-rows query: the SELECT
+    # becomes an index-only scan over just the rows still missing a zip.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_restaurants_pending
+        ON restaurants(city, place_id)
+        WHERE postal_code IS NULL;
+    """)
+    # The batch UPDATE joins on place_id alone.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_restaurants_placeid ON restaurants(place_id);")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_restaurants_postal_code ON restaurants(postal_code);")
-    conn.commit()
+    conn.execute("ANALYZE;")
 
-def main():
+async def run():
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         raise RuntimeError("Missing GOOGLE_API_KEY in environment (.env)")
@@ -65,88 +200,104 @@ def main():
     if not os.path.exists(DB_PATH):
         raise FileNotFoundError(f"Cannot find DB at: {DB_PATH}")
 
-    conn = sqlite3.connect(DB_PATH)
+    # isolation_level=None: autocommit mode, batches run in explicit
+    # BEGIN IMMEDIATE transactions instead of Python's hidden ones.
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
     ensure_indexes(conn)
 
+    # GROUP BY place_id: a restaurant near a city boundary can sit in two
+    # city rows, and each duplicate row would otherwise cost a billable
+    # Details call. Fetch once per unique place and update all its rows.
     rows = conn.execute("""
-        SELECT city, place_id
+        SELECT MIN(city) AS city, place_id
         FROM restaurants
         WHERE postal_code IS NULL
           AND place_id IS NOT NULL
+        GROUP BY place_id
         ORDER BY city
     """).fetchall()
 
     total = len(rows)
-    print(f"[info] Need to fill postal_code for {total} places")
+    print(f"[info] Need to fill postal_code for {total} unique places")
 
     updated = 0
     skipped = 0
-    over_limit_hits = 0
     start = time.time()
 
+    limiter = AdaptiveLimiter(MAX_QPS)
+    sem = asyncio.Semaphore(CONCURRENCY)
+    throttle = Throttle()
+    url_for = details_url_for(api_key)
+
+    # HTTP/2: all CONCURRENCY in-flight Details requests multiplex as
+    # streams over a single connection to maps.googleapis.com.
+    limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=8)
+    timeout = httpx.Timeout(TIMEOUT)
+
+    # Coroutines only fetch; the sqlite3 connection is synchronous, so all
+    # writes happen here between awaits as results stream in.
     try:
-        for i, (city, place_id) in enumerate(rows, start=1):
-            time.sleep(SLEEP_SEC)
-
-            retry = 0
-            backoff = 1.0
-            while True:
-                try:
-                    postal_code, formatted_address, status = fetch_details(api_key, place_id)
-
-                    if status == "OK":
-                        conn.execute("""
-                            UPDATE restaurants
-                            SET postal_code = ?,
-                                formatted_address = ?,
-                                details_fetched_at = ?
-                            WHERE place_id = ? AND city = ?
-                        """, (postal_code, formatted_address, datetime.utcnow().isoformat(timespec="seconds"), place_id, city))
-                        updated += 1
-
-                    elif status == "OVER_QUERY_LIMIT":
-                        over_limit_hits += 1
-                        wait = min(60, backoff)
-                        print(f"[rate] OVER_QUERY_LIMIT at {i}/{total}. sleeping {wait:.1f}s (hit={over_limit_hits})")
-                        time.sleep(wait)
-                        backoff *= 2
-                        retry += 1
-                        if retry > MAX_RETRIES:
-                            print("[rate] Too many retries. Stop now; rerun later to continue.")
-                            raise SystemExit(2)
-                        continue
-
-                    else:
-                        skipped += 1
-                        if i % 200 == 0 or status not in ("ZERO_RESULTS",):
-                            print(f"[skip] {status} city={city} place_id={place_id}")
-
-                    break # exit retry loop on success or non-retryable status
-
-                except requests.RequestException as e:
-                    retry += 1
-                    if retry > MAX_RETRIES:
-                        print(f"[net] give up place_id={place_id} after {MAX_RETRIES} retries: {e}")
-                        skipped += 1
-                        break
-                    wait = min(30, 2 ** retry)
-                    print(f"[net] error {e}; retry in {wait}s (place_id={place_id})")
-                    time.sleep(wait)
-
-            if i % BATCH_COMMIT == 0:
-                conn.commit()
-                elapsed = time.time() - start
-                rate = i / elapsed if elapsed > 0 else 0
-                print(f"[progress] {i}/{total} updated={updated} skipped={skipped} rate={rate:.2f} req/s")
-
-        conn.commit()
+        async with httpx.AsyncClient(http2=True, limits=limits, timeout=timeout) as session:
+            tasks = [
+                asyncio.create_task(
+                    fetch_one(session, limiter, sem, throttle, url_for, city, place_id)
+                )
+                for city, place_id in rows
+            ]
+
+            # Completed fetches accumulate here and hit sqlite as one
+            # executemany per batch instead of a statement per row.
+            pending = []
+
+            def flush():
+                if not pending:
+                    return
+                # One json_each-driven UPDATE applies the whole batch:
+                # a single statement and plan instead of one per row.
+                conn.execute("BEGIN IMMEDIATE;")
+                conn.execute("""
+                    UPDATE restaurants
+                    SET postal_code = j.value ->> 'zip',
+                        formatted_address = j.value ->> 'addr',
+                        details_fetched_at = datetime('now')
+                    FROM json_each(?) AS j
+                    WHERE restaurants.place_id = j.value ->> 'pid'
+                """, (orjson.dumps(pending).decode(),))
+                conn.execute("COMMIT;")
+                pending.clear()
+
+            for i, future in enumerate(asyncio.as_completed(tasks), start=1):
+                city, place_id, postal_code, formatted_address, status = await future
+
+                if status == "OK":
+                    pending.append({
+                        "pid": place_id,
+                        "zip": postal_code,
+                        "addr": formatted_address,
+                    })
+                    updated += 1
+                else:
+                    skipped += 1
+                    if i % 200 == 0 or status not in ("ZERO_RESULTS",):
+                        print(f"[skip] {status} city={city} place_id={place_id}")
+
+                if len(pending) >= BATCH_COMMIT:
+                    flush()
+                    elapsed = time.time() - start
+                    rate = i / elapsed if elapsed > 0 else 0
+                    print(f"[progress] {i}/{total} updated={updated} skipped={skipped} rate={rate:.2f} req/s")
+
+        flush()
 
     finally:
         conn.close()
 
     print(f"[done] updated={updated} skipped={skipped} total={total}")
 
+def main():
+    asyncio.run(run())
+
 if __name__ == "__main__":
     main()
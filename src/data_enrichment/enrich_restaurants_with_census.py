@@ -1,10 +1,36 @@
 import os
+import csv
 import sqlite3
-import requests
-import pandas as pd
-from src.config import DB_PATH, ENRICHED_CSV_PATH 
-
-CENSUS_API_KEY = os.getenv("CENSUS_API_KEY") 
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from urllib3.util.retry import Retry
+from src.config import DATA_DIR, DB_PATH, ENRICHED_CSV_PATH
+
+CENSUS_API_KEY = os.getenv("CENSUS_API_KEY")
+
+# ACS 5-year responses for a (state, place) pair never change, so cache
+# them on disk: re-runs skip the Census round-trips entirely. The session
+# still pools connections and retries transient 5xx responses. Built
+# lazily so importing this module doesn't create the cache file.
+@functools.lru_cache(maxsize=None)
+def _session() -> CachedSession:
+    session = CachedSession(
+        str(DATA_DIR / ".census_cache.sqlite"),
+        expire_after=30 * 86400,
+    )
+    session.mount("https://", HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=8,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=["GET"],
+        ),
+    ))
+    return session
 
 ACS_SUBJECT_2022 = "https://api.census.gov/data/2022/acs/acs5/subject"
 ACS_DETAILED_2022 = "https://api.census.gov/data/2022/acs/acs5"
@@ -24,7 +50,7 @@ def census_get(url: str, params: dict) -> list:
         params = dict(params)
         params["key"] = CENSUS_API_KEY
 
-    r = requests.get(url, params=params, timeout=30)
+    r = _session().get(url, params=params, timeout=30)
     r.raise_for_status()
     return r.json()
 
@@ -93,26 +119,15 @@ def main():
     if not os.path.exists(DB_PATH):
         raise FileNotFoundError(f"Cannot find DB at: {DB_PATH}")
 
-    # 1) Load restaurants
     conn = sqlite3.connect(DB_PATH)
-    restaurants = pd.read_sql(
-        """
-        SELECT
-            place_id,
-            city,
-            name,
-            rating,
-            user_ratings_total,
-            price_level,
-            business_status,
-            types
-        FROM restaurants
-        """,
-        conn,
-    )
 
-    # 2) Fetch demographics for each city that exists in your DB
-    cities_in_db = sorted(set(restaurants["city"].dropna().unique().tolist()))
+    # 1) Fetch demographics for each city that exists in your DB
+    cities_in_db = [
+        row[0]
+        for row in conn.execute(
+            "SELECT DISTINCT city FROM restaurants WHERE city IS NOT NULL ORDER BY city"
+        )
+    ]
     missing = [c for c in cities_in_db if c not in CITY_FIPS]
 
     if missing:
@@ -121,33 +136,83 @@ def main():
             print(" -", c)
         print("They will get NULL demographic fields unless you add FIPS mapping.\n")
 
-    demo_rows = []
-    for city in cities_in_db:
-        if city not in CITY_FIPS:
-            continue
+    def fetch_one(city: str) -> dict:
         f = CITY_FIPS[city]
         print(f"[fetch] {city} (state={f['state']}, place={f['place']})")
-        demo_rows.append(fetch_city_demographics(city, f["state"], f["place"]))
-
-    demographics = pd.DataFrame(demo_rows)
-
-    # 3) Enrich (left join)
-    enriched = restaurants.merge(demographics, on="city", how="left")
-
-    # 4) Save results: (a) CSV in data/ (b) new sqlite table
-    enriched.to_csv(str(ENRICHED_CSV_PATH), index=False)
+        return fetch_city_demographics(city, f["state"], f["place"])
+
+    # Each city costs 2 serial HTTPS round-trips; fetching the cities in
+    # parallel collapses total latency to roughly the slowest one.
+    mapped = [c for c in cities_in_db if c in CITY_FIPS]
+    with ThreadPoolExecutor(max_workers=min(16, 2 * max(len(mapped), 1))) as ex:
+        demo_rows = list(ex.map(fetch_one, mapped))
+
+    # 2) Write the tiny demographics table with executemany in one
+    # transaction, then build restaurants_enriched with a SQL join —
+    # the big table never passes through pandas.
+    demo_cols = [
+        "city", "census_name", "population_total", "median_age",
+        "pct_under_18", "pct_65_plus", "median_household_income",
+        "census_state_fips", "census_place_fips",
+    ]
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS city_demographics;")
+        conn.execute("""
+            CREATE TABLE city_demographics (
+                city TEXT PRIMARY KEY,
+                census_name TEXT,
+                population_total INTEGER,
+                median_age REAL,
+                pct_under_18 REAL,
+                pct_65_plus REAL,
+                median_household_income INTEGER,
+                census_state_fips TEXT,
+                census_place_fips TEXT
+            );
+        """)
+        conn.executemany(
+            f"INSERT INTO city_demographics ({', '.join(demo_cols)}) VALUES ({', '.join('?' * len(demo_cols))})",
+            [tuple(row[c] for c in demo_cols) for row in demo_rows],
+        )
+        conn.executescript("""
+            DROP TABLE IF EXISTS restaurants_enriched;
+            CREATE TABLE restaurants_enriched AS
+            SELECT
+                r.*,
+                d.population_total,
+                d.median_age,
+                d.pct_under_18,
+                d.pct_65_plus,
+                d.median_household_income,
+                d.census_name
+            FROM restaurants r
+            LEFT JOIN city_demographics d USING (city);
+        """)
+
+    # 3) Stream the enriched table into the CSV in fixed-size chunks:
+    # memory stays bounded by CSV_CHUNK_ROWS however large the table grows.
+    CSV_CHUNK_ROWS = 50_000
+    cur = conn.execute("SELECT * FROM restaurants_enriched")
+    with open(ENRICHED_CSV_PATH, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([d[0] for d in cur.description])
+        while True:
+            rows = cur.fetchmany(CSV_CHUNK_ROWS)
+            if not rows:
+                break
+            writer.writerows(rows)
     print(f"\n[saved] {ENRICHED_CSV_PATH}")
 
-    demographics.to_sql("city_demographics", conn, if_exists="replace", index=False)
-    enriched.to_sql("restaurants_enriched", conn, if_exists="replace", index=False)
-    conn.close()
-
-    # 5) Quick sanity print
+    # 4) Quick sanity print
     print("\n=== City demographics used ===")
-    print(demographics.to_string(index=False))
+    for row in demo_rows:
+        print(row)
 
     print("\n=== Enriched dataset preview ===")
-    print(enriched.head(5).to_string(index=False))
+    for row in conn.execute("SELECT * FROM restaurants_enriched LIMIT 5"):
+        print(row)
+
+    conn.close()
 
 if __name__ == "__main__":
     main()